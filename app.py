@@ -1,141 +1,790 @@
 import os
+import re
 import json
+import time
+import pickle
+import sqlite3
+import asyncio
+import hashlib
+import logging
+import threading
+from contextlib import closing
+import faiss
+import httpx
+import numpy as np
+import orjson
 import streamlit as st
-from openai import OpenAI
+from openai import (OpenAI, AsyncOpenAI, APIConnectionError, BadRequestError,
+                    InternalServerError, NotFoundError, RateLimitError)
 from dotenv import load_dotenv
+from tenacity import (retry, retry_if_exception_type, stop_after_attempt,
+                      wait_exponential_jitter)
 
 # Load environment variables
 load_dotenv()
 
+logger = logging.getLogger(__name__)
+if not logger.handlers:
+    # Streamlit re-runs this module, so the handler is only attached once
+    _handler = logging.StreamHandler()
+    _handler.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(message)s"))
+    logger.addHandler(_handler)
+    logger.setLevel(logging.INFO)
+
 # Set up OpenAI API key
 openai_api_key = os.getenv('OPENAI_API_KEY')
 if not openai_api_key:
     st.error('OPENAI_API_KEY not found in environment. Please set it in a .env file.')
     st.stop()
 
-client = OpenAI(api_key=openai_api_key)
+HTTP_LIMITS = httpx.Limits(max_connections=100, max_keepalive_connections=50)
+HTTP_TIMEOUT = httpx.Timeout(60.0)
+
+
+def _http_version_logger():
+    # Logs the negotiated protocol at INFO for the first response on a
+    # pool, enough to confirm HTTP/2 without a line per request
+    logged = False
+
+    def log(response):
+        nonlocal logged
+        if not logged:
+            logged = True
+            logger.info("Connected to %s over %s", response.request.url.host,
+                        response.http_version)
+    return log
+
+
+@st.cache_resource
+def get_client():
+    # The sync client (cached and streamed calls from the script thread)
+    # gets the same pooled HTTP/2 transport, built once rather than on
+    # every rerun. Retries are handled by api_retry below, so the SDK's
+    # own are disabled.
+    http_client = httpx.Client(
+        http2=True,
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        event_hooks={"response": [_http_version_logger()]}
+    )
+    return OpenAI(api_key=openai_api_key, http_client=http_client, max_retries=0)
+
+
+def _http_client():
+    # One pooled HTTP/2 connection carries the concurrent async requests as
+    # multiplexed streams instead of a TCP+TLS handshake per request. It is
+    # built per Step 2 round, not at import, since the module re-runs on
+    # every widget interaction, and is closed inside the event loop that
+    # opened it.
+    log_http_version = _http_version_logger()
+
+    async def on_response(response):
+        log_http_version(response)
+
+    return httpx.AsyncClient(
+        http2=True,
+        limits=HTTP_LIMITS,
+        timeout=HTTP_TIMEOUT,
+        event_hooks={"response": [on_response]}
+    )
+
+
+# Transient API failures (rate limits, 5xx, dropped connections and
+# timeouts) are retried with jittered exponential backoff; anything else,
+# such as a 400, is raised straight away.
+api_retry = retry(
+    wait=wait_exponential_jitter(initial=1, max=30),
+    stop=stop_after_attempt(5),
+    retry=retry_if_exception_type((RateLimitError, APIConnectionError, InternalServerError)),
+    reraise=True
+)
+
+# On-disk cache of Responses API results, keyed on the request payload
+CACHE_PATH = ".llm_cache.db"
+CACHE_TTL = 7 * 24 * 60 * 60  # seconds
+CACHE_PRUNE_INTERVAL = 24 * 60 * 60  # seconds
+
+
+def _cache_connect():
+    conn = sqlite3.connect(CACHE_PATH)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, response BLOB, ts REAL)")
+    return conn
+
+
+def _cache_key(kwargs):
+    # Every argument goes into the key, so changing any of them (model,
+    # input, instructions, tools, previous_response_id, ...) is a miss.
+    payload = orjson.dumps(kwargs, default=str, option=orjson.OPT_SORT_KEYS)
+    return hashlib.sha256(payload).hexdigest()
+
+
+def _cache_get(key):
+    with closing(_cache_connect()) as conn:
+        row = conn.execute(
+            "SELECT response FROM responses WHERE key = ? AND ts > ?",
+            (key, time.time() - CACHE_TTL)
+        ).fetchone()
+        if row is None:
+            return None
+        try:
+            return pickle.loads(row[0])
+        except Exception:
+            # A corrupt row, or one pickled by another openai SDK version,
+            # is dropped and treated as a miss
+            logger.warning("Discarding unreadable cache entry %s", key)
+            with conn:
+                conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            return None
+
+
+def _cache_put(key, response):
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?)",
+            (key, pickle.dumps(response), time.time())
+        )
+
+
+@st.cache_resource(ttl=CACHE_PRUNE_INTERVAL)
+def _prune_cache():
+    # Runs once per process and then at most daily, so expired rows don't
+    # accumulate in the database
+    with closing(_cache_connect()) as conn, conn:
+        conn.execute("DELETE FROM responses WHERE ts <= ?", (time.time() - CACHE_TTL,))
+
+
+_prune_cache()
+
+
+# Embedding cache for paraphrased prompts, consulted after an exact-match miss
+SEMANTIC_CACHE_PATH = ".semantic_cache.pkl"
+EMBEDDING_MODEL = "text-embedding-3-small"
+EMBEDDING_DIM = 1536
+SEMANTIC_THRESHOLD = 0.9  # cosine similarity
+# Neighbours checked per lookup, so an expired nearest entry doesn't mask
+# a fresh one just behind it
+SEMANTIC_NEIGHBOURS = 5
 
+
+class SemanticCache:
+    """Inner-product FAISS index over normalized prompt embeddings, with
+    the (prompt, pickled response, timestamp, vector) entries kept in a
+    parallel list. One instance is shared by every session, and sessions
+    run on separate script threads, so the index and the list only change
+    together under the lock.
+
+    Only the entries are persisted, as a single file that is replaced
+    atomically; the index is rebuilt from their vectors on load, so the
+    two can never be out of step on disk."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.dirty = False
+        self.entries = []
+        if os.path.exists(path):
+            with open(path, "rb") as f:
+                self.entries = pickle.load(f)
+        self.index = self._build_index(self.entries)
+        self._evict()
+
+    @staticmethod
+    def _build_index(entries):
+        index = faiss.IndexFlatIP(EMBEDDING_DIM)
+        if entries:
+            index.add(np.vstack([entry[3] for entry in entries]))
+        return index
+
+    def _evict(self):
+        # Entries expire on the same TTL as the exact-match cache
+        oldest = time.time() - CACHE_TTL
+        fresh = [entry for entry in self.entries if entry[2] > oldest]
+        if len(fresh) != len(self.entries):
+            self.entries = fresh
+            self.index = self._build_index(fresh)
+            self.dirty = True
+
+    def lookup(self, vector):
+        oldest = time.time() - CACHE_TTL
+        with self.lock:
+            if not self.entries:
+                return None
+            scores, ids = self.index.search(vector, min(SEMANTIC_NEIGHBOURS, len(self.entries)))
+            for score, i in zip(scores[0], ids[0]):
+                if score <= SEMANTIC_THRESHOLD:
+                    break
+                _, response, ts, _ = self.entries[i]
+                if ts > oldest:
+                    return pickle.loads(response)
+        return None
+
+    def add(self, vector, prompt, response):
+        with self.lock:
+            self.index.add(vector)
+            self.entries.append((prompt, pickle.dumps(response), time.time(), vector[0]))
+            self.dirty = True
+
+    def save(self):
+        # Called once per search round, off the event loop. Expired entries
+        # are dropped first so the file doesn't grow without bound, and the
+        # snapshot is written to a temp file then renamed into place.
+        with self.save_lock:
+            with self.lock:
+                self._evict()
+                if not self.dirty:
+                    return
+                snapshot = list(self.entries)
+                self.dirty = False
+            tmp_path = self.path + ".tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(snapshot, f)
+            os.replace(tmp_path, self.path)
+
+
+@st.cache_resource
+def get_semantic_cache():
+    # Shared across reruns and sessions
+    return SemanticCache(SEMANTIC_CACHE_PATH)
+
+
+async def _embed(aclient, text):
+    embedding = await aclient.embeddings.create(model=EMBEDDING_MODEL, input=text)
+    vector = np.array([embedding.data[0].embedding], dtype="float32")
+    faiss.normalize_L2(vector)
+    return vector
+
+
+def _log_usage(response):
+    # A stable prompt prefix shows up as a growing cached share of the input
+    usage = response.usage
+    if usage is not None:
+        logger.info("%s: %d of %d input tokens served from the prompt cache",
+                    response.model, usage.input_tokens_details.cached_tokens,
+                    usage.input_tokens)
+
+
+@api_retry
+def cached_responses_create(**kwargs):
+    key = _cache_key(kwargs)
+    response = _cache_get(key)
+    if response is None:
+        response = get_client().responses.create(**kwargs)
+        _log_usage(response)
+        _cache_put(key, response)
+    return response
+
+
+@api_retry
+def _open_stream(**kwargs):
+    # Only opening the stream is retried; deltas already yielded can't be
+    return get_client().responses.create(stream=True, **kwargs)
+
+
+def _is_expired_state(error):
+    # Stored responses are only retained for 30 days, after which chaining
+    # from one is rejected and the full context has to be sent again
+    return error.param == "previous_response_id"
+
+
+def stream_responses_create(**kwargs):
+    # Yields output text deltas as they arrive. A cache hit is replayed as
+    # a single chunk, and only streams that run to completion are cached.
+    key = _cache_key(kwargs)
+    response = _cache_get(key)
+    if response is not None:
+        yield response.output_text
+        return
+    with _open_stream(**kwargs) as stream:
+        for event in stream:
+            if event.type == "response.output_text.delta":
+                yield event.delta
+            elif event.type == "response.completed":
+                _log_usage(event.response)
+                _cache_put(key, event.response)
+
+
+@api_retry
+async def acached_responses_create(aclient, semantic_text=None, **kwargs):
+    # semantic_text opts the call into the embedding cache; only novel
+    # prompts that miss the exact-match cache pay for the embedding.
+    key = _cache_key(kwargs)
+    response = _cache_get(key)
+    if response is not None:
+        return response
+    if semantic_text is not None:
+        semantic_cache = get_semantic_cache()
+        vector = await _embed(aclient, semantic_text)
+        response = semantic_cache.lookup(vector)
+        if response is not None:
+            # Not copied into the exact cache, which would restart its TTL
+            return response
+    response = await aclient.responses.create(**kwargs)
+    _log_usage(response)
+    if semantic_text is not None:
+        semantic_cache.add(vector, semantic_text, response)
+    _cache_put(key, response)
+    return response
+
+
+# Model routing: gpt-4.1 is kept for the calls whose output quality drives
+# the research (the plan, the web searches and the final report).
+# Boilerplate generation (clarifying questions, follow-up queries) runs on
+# gpt-4.1-mini, and the yes/no sufficiency check runs on gpt-4.1-nano.
 MODEL = "gpt-4.1"
 MODEL_MINI = "gpt-4.1-mini"
+MODEL_NANO = "gpt-4.1-nano"
 TOOLS = [{"type": "web_search"}]
+# Upper bound on in-flight web searches, to stay inside the API rate limits
+MAX_CONCURRENT_SEARCHES = 10
+# Results needed before the evaluator starts speculatively on partial data
+SPECULATIVE_EVAL_MIN_RESULTS = 3
+# In-process memo for the pure prompt -> result functions, so reruns with
+# unchanged arguments skip the call and the parsing entirely
+RESULT_CACHE_TTL = 3600  # seconds
 developer_message = """
 You are an expert deep researcher.
 You must provide complete and in-depth research to the user.
 """
 
-
-def get_clarifying_questions(topic):
-    prompt = f"""
-Ask 5 numbered clarifying questions about the following topic: {topic}.
+# Task instructions are fixed text appended to developer_message and passed
+# as instructions=, with only the request-specific text in input. That keeps
+# the prompt prefix byte-identical across calls for OpenAI's prompt cache,
+# and, unlike input messages, instructions are not carried into responses
+# chained from this one, so one task's rules never leak into the next.
+CLARIFY_INSTRUCTIONS = """
+Ask 5 numbered clarifying questions about the topic given by the user.
 The goal of the questions is to understand the intended purpose of the research.
 Reply only with the questions
 """
-    clarify = client.responses.create(
+PLAN_INSTRUCTIONS = """
+Using the user's answers to the clarifying questions, write a goal sentence, and 5 web search queries for the research about the topic.
+Output: The goal sentence and the 5 web search queries that will reach it.
+"""
+BATCH_SEARCH_INSTRUCTIONS = """
+Perform a web_search for each of the queries in the JSON list given by the user.
+Output: One result per query, in the same order. Cite sources inline in each research_output as markdown links: [title](url).
+"""
+EVALUATE_INSTRUCTIONS = """
+Does the research data fully satisfy the research goal? Answer with a single token: Y or N.
+"""
+# Smallest output cap the Responses API accepts
+EVALUATE_MAX_OUTPUT_TOKENS = 16
+MORE_QUERIES_INSTRUCTIONS = """
+The research data has not met the research goal. Write 5 more web searches to achieve the goal.
+Output: The 5 web search queries.
+"""
+SUMMARY_INSTRUCTIONS = """
+Summarize the research output given by the user in 150 words.
+"""
+SUMMARY_MAX_OUTPUT_TOKENS = 256
+# Cited passages kept per search result for the report
+SNIPPETS_PER_RESULT = 3
+SNIPPET_MAX_CHARS = 500
+REPORT_INSTRUCTIONS = """
+Write a complete and detailed report about the research goal, using the research summaries and the sourced snippets.
+Cite sources inline using [n] and append a reference list mapping [n] to the snippet urls.
+"""
+
+# The full system messages, built once rather than on every call
+CLARIFY_SYSTEM = developer_message + CLARIFY_INSTRUCTIONS
+PLAN_SYSTEM = developer_message + PLAN_INSTRUCTIONS
+BATCH_SEARCH_SYSTEM = developer_message + BATCH_SEARCH_INSTRUCTIONS
+EVALUATE_SYSTEM = developer_message + EVALUATE_INSTRUCTIONS
+MORE_QUERIES_SYSTEM = developer_message + MORE_QUERIES_INSTRUCTIONS
+SUMMARY_SYSTEM = developer_message + SUMMARY_INSTRUCTIONS
+REPORT_SYSTEM = developer_message + REPORT_INSTRUCTIONS
+
+# Templates for the request-specific messages, filled in with .format();
+# the variable slots are the only part of a prompt that changes
+CLARIFY_TEMPLATE = "Topic: {topic}"
+PLAN_TEMPLATE = "Topic: {topic}\nQuestions: {questions}\nAnswers: {answers}"
+SEARCH_TEMPLATE = "search: {query}"
+RESEARCH_TEMPLATE = "Research goal: {goal}\nResearch data: {data}"
+NEW_RESEARCH_TEMPLATE = "New research data: {data}"
+SEARCHED_TEMPLATE = "\nAlready searched, do not repeat: {searched}"
+REPORT_TEMPLATE = "Research goal: {goal}\nResearch summaries and sources: {research}"
+
+# Structured output formats, so the JSON replies always parse
+QUERIES_SCHEMA = {"type": "array", "items": {"type": "string"}, "minItems": 5, "maxItems": 5}
+PLAN_FORMAT = {
+    "type": "json_schema",
+    "name": "plan",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"goal": {"type": "string"}, "queries": QUERIES_SCHEMA},
+        "required": ["goal", "queries"],
+        "additionalProperties": False
+    }
+}
+MORE_QUERIES_FORMAT = {
+    "type": "json_schema",
+    "name": "more_queries",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {"queries": QUERIES_SCHEMA},
+        "required": ["queries"],
+        "additionalProperties": False
+    }
+}
+BATCH_SEARCH_FORMAT = {
+    "type": "json_schema",
+    "name": "batch_search",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {"query": {"type": "string"},
+                                   "research_output": {"type": "string"}},
+                    "required": ["query", "research_output"],
+                    "additionalProperties": False
+                }
+            }
+        },
+        "required": ["results"],
+        "additionalProperties": False
+    }
+}
+
+
+@st.cache_data(ttl=RESULT_CACHE_TTL, show_spinner=False)
+def get_clarifying_questions(topic):
+    clarify = cached_responses_create(
         model=MODEL_MINI,
-        input=prompt,
-        instructions=developer_message
+        instructions=CLARIFY_SYSTEM,
+        input=CLARIFY_TEMPLATE.format(topic=topic)
     )
     questions = clarify.output[0].content[0].text.split("\n")
     return [q for q in questions if q.strip()], clarify.id
 
 
+@st.cache_data(ttl=RESULT_CACHE_TTL, show_spinner=False)
 def get_goal_and_queries(topic, questions, answers, clarify_id):
-    prompt = f"""
-Using the user's {answers} to the {questions}, write a goal sentence, and 5 web search queries for the research about {topic}.
-Output: A json list of the goal sentence and the 5 web search queries that will reach it.
-Format: {{\"goal\": \"...\", \"queries\": [\"q1\", ....]}}
-"""
-    goal_and_queries = client.responses.create(
+    goal_and_queries = cached_responses_create(
         model=MODEL,
-        input=prompt,
+        instructions=PLAN_SYSTEM,
+        input=PLAN_TEMPLATE.format(topic=topic, questions=questions, answers=answers),
         previous_response_id=clarify_id,
-        instructions=developer_message
+        text={"format": PLAN_FORMAT}
     )
-    plan = json.loads(goal_and_queries.output[0].content[0].text)
+    plan = json.loads(goal_and_queries.output_text)
     return plan, goal_and_queries.id
 
 
-def run_search(query, previous_response_id):
-    web_search = client.responses.create(
-        model=MODEL,
-        input=f"search: {query}",
-        previous_response_id=previous_response_id,
-        instructions=developer_message,
-        tools=TOOLS
-    )
-    return {
+async def run_search(aclient, query, previous_response_id, semaphore):
+    async with semaphore:
+        web_search = await acached_responses_create(
+            aclient,
+            semantic_text=query,
+            model=MODEL,
+            instructions=developer_message,
+            input=SEARCH_TEMPLATE.format(query=query),
+            previous_response_id=previous_response_id,
+            tools=TOOLS
+        )
+    item = {
         "query": query,
-        "resp_id": web_search.output[1].id,
-        "research_output": web_search.output[1].content[0].text
+        "research_output": web_search.output_text,
+        "snippets": extract_snippets(web_search, query)
     }
+    item["summary"] = await summarize(aclient, item)
+    return item
 
 
-def evaluate_responses(goal, collected):
-    review = client.responses.create(
+async def run_search_batch(aclient, queries, previous_response_id, semaphore):
+    # One request for all the queries saves the per-call overhead of the
+    # fan-out, at the cost of nothing being evaluated until it is all back
+    batch = await acached_responses_create(
+        aclient,
         model=MODEL,
-        input=[
-            {"role": "developer", "content": f"Research goal: {goal}"},
-            {"role": "assistant", "content": json.dumps(collected)},
-            {"role": "user", "content": "Does this information fully satisfy the goal? Answer Yes or No only."}
-        ],
-        instructions=developer_message
+        instructions=BATCH_SEARCH_SYSTEM,
+        input=json.dumps(queries),
+        previous_response_id=previous_response_id,
+        tools=TOOLS,
+        text={"format": BATCH_SEARCH_FORMAT}
+    )
+    try:
+        results = json.loads(batch.output_text)["results"]
+    except json.JSONDecodeError:
+        # Refused or cut short before the JSON was complete
+        results = None
+    if results is None or len(results) != len(queries):
+        # Unparsable, or a miscount the schema can't rule out: search the
+        # queries one by one instead
+        return list(await asyncio.gather(
+            *[run_search(aclient, q, previous_response_id, semaphore) for q in queries]))
+    collected = [
+        {
+            "query": query,
+            "research_output": result["research_output"],
+            "snippets": extract_text_snippets(result["research_output"], query)
+        }
+        for query, result in zip(queries, results)
+    ]
+    summaries = await asyncio.gather(*[summarize(aclient, item) for item in collected])
+    for item, summary in zip(collected, summaries):
+        item["summary"] = summary
+    return collected
+
+
+async def _as_list(search):
+    return [await search]
+
+
+def _cited_passages(text, citations):
+    # The paragraph holding each (start, end, url) citation, cut to the
+    # text around it and capped at SNIPPET_MAX_CHARS
+    for start_index, end_index, url in citations:
+        start = text.rfind("\n", 0, start_index) + 1
+        start = max(start, end_index - SNIPPET_MAX_CHARS)
+        end = text.find("\n", end_index)
+        end = min(end if end != -1 else len(text), start + SNIPPET_MAX_CHARS)
+        yield text[start:end].strip(), url
+
+
+def _top_snippets(passages, query):
+    # Distinct passages ranked by how many query terms they share
+    terms = set(_normalize_query(query))
+    ranked = sorted(dict.fromkeys(passages),
+                    key=lambda p: len(terms.intersection(_normalize_query(p[0]))),
+                    reverse=True)
+    return [{"text": text, "url": url} for text, url in ranked[:SNIPPETS_PER_RESULT]]
+
+
+def extract_snippets(web_search, query):
+    # The top cited passages of a search result, each with the url it
+    # cites. These stand in for the raw output in the report prompt.
+    passages = []
+    for output in web_search.output:
+        if output.type != "message":
+            continue
+        for part in output.content:
+            if part.type != "output_text":
+                continue
+            passages.extend(_cited_passages(part.text, [
+                (annotation.start_index, annotation.end_index, annotation.url)
+                for annotation in part.annotations if annotation.type == "url_citation"]))
+    return _top_snippets(passages, query)
+
+
+# Inline markdown link, as the batch search is asked to cite with
+MARKDOWN_LINK = re.compile(r"\[[^\]]*\]\((https?://[^)\s]+)\)")
+
+
+def extract_text_snippets(text, query):
+    # For one item of a batch reply. The response's annotations index into
+    # the whole JSON reply and can't be attributed to an item, so the
+    # citations come from the markdown links inside the item's own text.
+    citations = [(m.start(), m.end(), m.group(1)) for m in MARKDOWN_LINK.finditer(text)]
+    return _top_snippets(_cited_passages(text, citations), query)
+
+
+async def summarize(aclient, item):
+    # Short summaries stand in for the raw output in the evaluator and
+    # follow-up prompts, which keeps their input small
+    summary = await acached_responses_create(
+        aclient,
+        model=MODEL_MINI,
+        instructions=SUMMARY_SYSTEM,
+        input=item["research_output"],
+        max_output_tokens=SUMMARY_MAX_OUTPUT_TOKENS
+    )
+    return summary.output_text
+
+
+def _normalize_query(query):
+    # Case, punctuation and whitespace differences don't make a new search
+    return tuple(re.sub(r"[^\w\s]", "", query.lower()).split())
+
+
+def new_query_flags(queries, collected):
+    # Whether each query still needs searching: False for one already in
+    # the collected results or repeated earlier in the list
+    seen = {_normalize_query(item["query"]) for item in collected}
+    flags = []
+    for q in queries:
+        normalized = _normalize_query(q)
+        flags.append(normalized not in seen)
+        seen.add(normalized)
+    return flags
+
+
+def serialize_collected(collected, fields=("query", "summary")):
+    # Serialized once per search round and reused by every prompt. Only the
+    # summaries go in by default; the report also asks for the snippets.
+    return orjson.dumps(
+        [{k: item[k] for k in fields} for item in collected],
+        option=orjson.OPT_SORT_KEYS
+    ).decode()
+
+
+async def evaluate_responses(aclient, goal, collected_json):
+    review = await acached_responses_create(
+        aclient,
+        model=MODEL_NANO,
+        instructions=EVALUATE_SYSTEM,
+        input=RESEARCH_TEMPLATE.format(goal=goal, data=collected_json),
+        max_output_tokens=EVALUATE_MAX_OUTPUT_TOKENS,
+        temperature=0
     )
     # Return both the boolean and the raw response for UI display
-    response_text = review.output[0].content[0].text
-    return ("yes" in response_text.lower(), response_text)
+    response_text = review.output_text
+    return (response_text.strip().upper().startswith("Y"), response_text)
 
 
-def get_more_queries(collected, goal, previous_response_id):
-    more_searches = client.responses.create(
-        model=MODEL,
-        input=[
-            {"role": "assistant",
-                "content": f"Current data: {json.dumps(collected)}"},
-            {"role": "user", "content": f"This has not me the goal: {goal}. Write 5 more web searches to achieve the goal"}
-        ],
-        instructions=developer_message,
-        previous_response_id=previous_response_id
+async def run_and_evaluate(goal, collected, queries, previous_response_id, status, batch=False):
+    async with _http_client() as http_client:
+        aclient = AsyncOpenAI(api_key=openai_api_key, http_client=http_client, max_retries=0)
+        try:
+            return await _run_and_evaluate(
+                aclient, goal, collected, queries, previous_response_id, status, batch)
+        finally:
+            # The round's new semantic cache entries are written out once,
+            # on a worker thread, rather than on every add
+            await asyncio.to_thread(get_semantic_cache().save)
+
+
+async def _run_and_evaluate(aclient, goal, collected, queries, previous_response_id, status, batch):
+    # Searches run concurrently and are collected as they complete. Once
+    # enough results are in, the evaluator runs on the partial data while
+    # the remaining searches are still in flight: a Yes ends the round
+    # early and cancels them, while a No is superseded by later results.
+    # With batch, the queries go out as a single task instead. Returns the
+    # results, their serialized summaries and the verdict.
+    collected = list(collected)
+    semaphore = asyncio.Semaphore(MAX_CONCURRENT_SEARCHES)
+    if batch and queries:
+        searches = {asyncio.create_task(
+            run_search_batch(aclient, queries, previous_response_id, semaphore))}
+    else:
+        searches = {asyncio.create_task(
+            _as_list(run_search(aclient, q, previous_response_id, semaphore))) for q in queries}
+    evaluation = None
+    evaluated = 0  # results seen by the last speculative evaluation
+    evaluated_json = None
+    try:
+        while searches:
+            pending = (searches | {evaluation}) if evaluation else searches
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task is evaluation:
+                    evaluation = None
+                    verdict = task.result()
+                    if verdict[0]:
+                        status.write("Goal satisfied before all searches finished")
+                        if len(collected) > evaluated:
+                            evaluated_json = serialize_collected(collected)
+                        return collected, evaluated_json, verdict
+                else:
+                    searches.discard(task)
+                    for item in task.result():
+                        collected.append(item)
+                        status.write(f"Searched: {item['query']}")
+            if (searches and evaluation is None and len(collected) > evaluated
+                    and len(collected) >= SPECULATIVE_EVAL_MIN_RESULTS):
+                evaluated = len(collected)
+                evaluated_json = serialize_collected(collected)
+                evaluation = asyncio.create_task(
+                    evaluate_responses(aclient, goal, evaluated_json))
+    finally:
+        # Await the cancelled tasks so none is left running against the
+        # client after it has been closed
+        leftover = [*searches, *([evaluation] if evaluation else [])]
+        for task in leftover:
+            task.cancel()
+        await asyncio.gather(*leftover, return_exceptions=True)
+    collected_json = serialize_collected(collected)
+    return collected, collected_json, await evaluate_responses(aclient, goal, collected_json)
+
+
+def get_more_queries(goal, collected, collected_json, sent_count, previous_response_id,
+                     searched=None):
+    # Chained from the previous follow-up request, or from the plan on the
+    # first round, so the stored conversation already holds the goal and
+    # every summary sent before; only the results added since then, past
+    # sent_count, are sent. If that state has expired, the full summaries
+    # go out unchained. searched lists the queries already run, for a retry
+    # after a round that only repeated them. Returns the queries and the id
+    # to chain from next.
+    searched = SEARCHED_TEMPLATE.format(searched=json.dumps(searched)) if searched else ""
+    request = dict(
+        model=MODEL_MINI,
+        instructions=MORE_QUERIES_SYSTEM,
+        text={"format": MORE_QUERIES_FORMAT}
     )
-    return json.loads(more_searches.output[0].content[0].text)
+    try:
+        more_searches = cached_responses_create(
+            previous_response_id=previous_response_id,
+            input=NEW_RESEARCH_TEMPLATE.format(
+                data=serialize_collected(collected[sent_count:])) + searched,
+            **request)
+    except (BadRequestError, NotFoundError) as error:
+        if not _is_expired_state(error):
+            raise
+        more_searches = cached_responses_create(
+            input=RESEARCH_TEMPLATE.format(goal=goal, data=collected_json) + searched,
+            **request)
+    return json.loads(more_searches.output_text)["queries"], more_searches.id
 
 
-def write_final_report(goal, collected):
-    report = client.responses.create(
+def write_final_report_stream(goal, report_json):
+    # Sent unchained: the searches run as parallel branches off the plan,
+    # so no stored conversation holds their results and chaining could only
+    # add the plan's history on top of the full payload. The summaries plus
+    # the top cited snippets are sent rather than the raw search output,
+    # which keeps the urls for the references at a fraction of the tokens.
+    yield from stream_responses_create(
         model=MODEL,
-        input=[
-            {"role": "developer", "content": (f"Write a complete and detailed report abouth the research goal: {goal}"
-                                              "Cite sources inline using [n] and append a reference"
-                                              "List mapping [n] to url")},
-            {"role": "assistant", "content": json.dumps(collected)},
-        ],
-        instructions=developer_message
+        instructions=REPORT_SYSTEM,
+        input=REPORT_TEMPLATE.format(goal=goal, research=report_json)
     )
-    return report.output[0].content[0].text
 
 
 # Streamlit UI
 st.title("Deep Research Clone")
 
-if 'step' not in st.session_state:
-    st.session_state.step = 0
-if 'topic' not in st.session_state:
-    st.session_state.topic = ''
-if 'questions' not in st.session_state:
-    st.session_state.questions = []
-if 'answers' not in st.session_state:
-    st.session_state.answers = []
-if 'clarify_id' not in st.session_state:
-    st.session_state.clarify_id = None
-if 'goal' not in st.session_state:
-    st.session_state.goal = ''
-if 'queries' not in st.session_state:
-    st.session_state.queries = []
-if 'goal_and_queries_id' not in st.session_state:
-    st.session_state.goal_and_queries_id = None
-if 'collected' not in st.session_state:
-    st.session_state.collected = []
-if 'report' not in st.session_state:
-    st.session_state.report = ''
+SESSION_DEFAULTS = {
+    'step': 0,
+    'topic': '',
+    'questions': [],
+    'answers': [],
+    'clarify_id': None,
+    'goal': '',
+    'queries': [],
+    'goal_and_queries_id': None,
+    'more_queries_id': None,
+    'sent_count': 0,
+    'collected': [],
+    'collected_json': '',
+    'report_json': '',
+    'evaluation': None,
+    'report': '',
+}
+for key, value in SESSION_DEFAULTS.items():
+    st.session_state.setdefault(key, value)
+
+
+def request_more_queries(searched=None):
+    more_queries, more_queries_id = get_more_queries(
+        st.session_state.goal,
+        st.session_state.collected,
+        st.session_state.collected_json,
+        st.session_state.sent_count,
+        st.session_state.more_queries_id or st.session_state.goal_and_queries_id,
+        searched
+    )
+    st.session_state.queries = more_queries
+    st.session_state.more_queries_id = more_queries_id
+    st.session_state.sent_count = len(st.session_state.collected)
+
 
 # Step 0: Enter topic
 if st.session_state.step == 0:
@@ -174,14 +823,38 @@ elif st.session_state.step == 1:
 elif st.session_state.step == 2:
     st.write(f"### Research Goal\n{st.session_state.goal}")
     st.write("### Web Search Queries")
-    for q in st.session_state.queries:
-        st.write(f"- {q}")
+    # Results accumulate across rounds, so queries already searched are skipped
+    is_new = new_query_flags(st.session_state.queries, st.session_state.collected)
+    for q, new in zip(st.session_state.queries, is_new):
+        st.write(f"- {q}" if new else f"- ~~{q}~~ (already searched, skipped)")
+    if not any(is_new):
+        # Running nothing would get the same cached verdict and follow-up
+        # queries back, so ask again, listing what has been searched
+        st.warning("All of these queries have already been searched.")
+        if st.button("Generate Different Queries"):
+            request_more_queries(searched=[item["query"] for item in st.session_state.collected])
+            st.rerun()
+        st.stop()
+    batch = st.checkbox(
+        "Send all searches as one request",
+        help="Less per-request overhead, but the results can't be evaluated until every search is back.")
     if st.button("Next: Run Web Searches"):
-        collected = []
-        for q in st.session_state.queries:
-            collected.append(run_search(
-                q, st.session_state.goal_and_queries_id))
+        queries_to_run = [q for q, new in zip(st.session_state.queries, is_new) if new]
+        with st.status("Running web searches...") as status:
+            collected, collected_json, evaluation = asyncio.run(run_and_evaluate(
+                st.session_state.goal,
+                st.session_state.collected,
+                queries_to_run,
+                st.session_state.goal_and_queries_id,
+                status,
+                batch
+            ))
+            status.update(label="Web searches complete", state="complete")
         st.session_state.collected = collected
+        st.session_state.evaluation = evaluation
+        st.session_state.collected_json = collected_json
+        st.session_state.report_json = serialize_collected(
+            collected, fields=("query", "summary", "snippets"))
         st.session_state.step = 3
         st.rerun()
 
@@ -192,35 +865,35 @@ elif st.session_state.step == 3:
         st.write(f"**Query:** {item['query']}")
         st.write(item['research_output'])
         st.write("---")
-    # Evaluate and show LLM response
-    is_sufficient, eval_response = evaluate_responses(
-        st.session_state.goal, st.session_state.collected)
+    # Show the LLM evaluation made while the searches ran
+    is_sufficient, eval_response = st.session_state.evaluation
     st.info(f"**LLM Evaluation:** {eval_response}")
     if is_sufficient:
         st.success("Sufficient information collected!")
         if st.button("Next: Write Final Report"):
-            st.session_state.report = write_final_report(
-                st.session_state.goal, st.session_state.collected)
             st.session_state.step = 4
             st.rerun()
     else:
         st.warning("Not enough information. Generating 5 more queries...")
         if st.button("Proceed Anyway"):
-            st.session_state.report = write_final_report(
-                st.session_state.goal, st.session_state.collected)
             st.session_state.step = 4
             st.rerun()
         if st.button("Generate 5 More Queries"):
-            more_queries = get_more_queries(
-                st.session_state.collected, st.session_state.goal, st.session_state.goal_and_queries_id)
-            st.session_state.queries = more_queries
+            request_more_queries()
             st.session_state.step = 2
             st.rerun()
 
 # Step 4: Display final report
 elif st.session_state.step == 4:
     st.write("## Final Research Report")
-    st.markdown(st.session_state.report)
+    if st.session_state.report:
+        st.markdown(st.session_state.report)
+    else:
+        # Paint the report as it is generated rather than after it finishes
+        st.session_state.report = st.write_stream(write_final_report_stream(
+            st.session_state.goal,
+            st.session_state.report_json
+        ))
     st.balloons()
     if st.button("Start New Research"):
         for key in list(st.session_state.keys()):